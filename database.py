@@ -2,17 +2,26 @@
 
 
 import os
-import sys
 import time
-import signal
+import queue
+import errno
+import ctypes
+import ctypes.util
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from stat import S_ISLNK
 from time import perf_counter as tpc
 
 import hexbase
-from info import Info
+from info import Info, LazyInfoDict, FIELDS, TMPNAME
 import sd.tree as tree
 from sd.format_number import rfs, sig, fmt_time
 from sd.file_progress import FileProgress, tprint
 
+CHECKPOINT_BYTES = 10 * 1024**3     # Write the journal after hashing this much data
+CHECKPOINT_TIME = 300               # or after this many seconds, whichever comes first
+
 
 def percent(num, digits=0):
     if not digits:
@@ -21,6 +30,38 @@ def percent(num, digits=0):
         return sig(num * 100, digits) + '%'
 
 
+def _load_renameat2():
+    "Return renameat2 from libc (Linux 3.15+, glibc 2.28+) or None"
+    try:
+        func = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).renameat2
+    except (OSError, AttributeError, TypeError):
+        return None
+    func.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint)
+    return func
+
+RENAMEAT2 = _load_renameat2()
+
+
+def rename_noreplace(src, dst):
+    "Rename src to dst, raising FileExistsError instead of overwriting dst"
+    if RENAMEAT2:
+        # AT_FDCWD = -100, RENAME_NOREPLACE = 1
+        if not RENAMEAT2(-100, os.fsencode(src), -100, os.fsencode(dst), 1):
+            return
+        err = ctypes.get_errno()
+        if err not in (errno.EINVAL, errno.ENOSYS):
+            raise OSError(err, os.strerror(err), src, None, dst)
+    # Filesystem or kernel doesn't support the flag
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+    os.rename(src, dst)
+
+
+def tmp_name(slot):
+    "Name of the temporary .par2 files for a job slot"
+    return TMPNAME + str(slot) if slot else TMPNAME
+
+
 def cant_read(name):
     "Look for unreadable files (not missing ones)"
     if not os.access(name, os.R_OK):
@@ -29,80 +70,184 @@ def cant_read(name):
     return False
 
 
-def walk(dirname, exclude, minimum=1, maximum=None):
-    "Walk through directory returning entry and pathname"
-    minimum = max(minimum, 1)       # Min size must be 1 byte to work
-
-
-    for entry in os.scandir(dirname):
-        if entry.is_symlink():
-            continue
-
-        if entry.name.endswith('.par2'):
-            continue
-        if entry.name == '.pardatabase':
-            continue
-        pathname = os.path.join(dirname, entry.name)
-
-        if cant_read(pathname):
-            continue
-        if entry.is_dir():
-            if not pathname == exclude:
-                yield from walk(pathname, exclude, minimum, maximum)
-
-        else:
-            stat = entry.stat()
-            size = stat.st_size
-            if size < minimum:
-                continue
-            if maximum and size > maximum:
-                continue
-            yield stat, pathname
+def map_ahead(func, items, threads=1):
+    '''Like map, but run func in a pool of threads, results in order.
+    At most 2 * threads items are queued, so a huge list doesn't become a huge list of futures'''
+    if threads <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(threads) as pool:
+        pending = collections.deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= 2 * threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # On an early exit only wait for the files already being read
+            for future in pending:
+                future.cancel()
+
+
+def prefetch(func, *args):
+    "Run func in a background thread, returning a function that waits for the result"
+    result = []
+
+    def run():
+        try:
+            result.append((True, func(*args)))
+        except Exception as err:        # pylint: disable=W0703
+            result.append((False, err))
+
+    # Daemon so that ctrl-c does not have to wait for a large file to finish
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    def wait():
+        thread.join()
+        status, value = result[0]
+        if not status:
+            raise value
+        return value
+    return wait
 
 
 
 class Database:
     "Database of files, hashes and their par2 files"
 
-    def __init__(self, basedir, target,):
+    def __init__(self, basedir, target, hashname=None):
 
         # Base directory to put the .pardatabase files
         self.basedir = os.path.join(basedir, '.pardatabase')
 
         self.target = target                # Target directory to scan
+        self.journal = os.path.join(self.basedir, 'journal.jsonl')  # Changes since the last save
+        self.dirty = set()                  # relative filenames changed since the last checkpoint
+        self.dirty_bytes = 0                # Bytes processed since the last checkpoint
+        self.last_checkpoint = tpc()        # Time of the last checkpoint
+        self.prefix = os.path.join(target, '')  # Target with trailing slash
         self.hexbase = hexbase.HexBase(self.basedir)
-        self.files = self.load()            # relative filename to Info
+        self.total_size = 0                 # Size of all files in database
+        self.files = self.load(hashname)    # relative filename to Info
+        self.visited = set()                # relative filenames seen by scan
+        self.newhashes_size = 0             # Bytes to hash without parity, found by scan
+        self.newpars_size = 0               # Bytes to hash with parity, found by scan
+        self.stop_requested = threading.Event()     # Set by ctrl-c to stop after the current file
         self.delay = None                   # Delay after hashing
-
-
-    def load(self,):
-        '''Load the database'''
-        self.hexbase.load()
-        files = self.hexbase.data
+        self.direct = False                 # Hash large files with O_DIRECT
+
+
+    def load(self, hashname=None):
+        '''Load the database
+        hashname = Hash to use for a new database'''
+        self.hexbase.load(hashname)
+        data = self.hexbase.data
+        if isinstance(data.get('pathname'), list):
+            # Columns of fields, see save()
+            count = len(data['pathname'])
+            columns = [data.get(key, [None] * count) for key in FIELDS]
+            rows = zip(*columns)
+        else:
+            # Older databases store a dict for each file
+            rows = (tuple(info.get(key) for key in FIELDS) for info in data.values())
+        # Info objects are made as files are looked up, so --repair doesn't need them all
+        files = LazyInfoDict(rows, base=self.target)
+        self.hexbase.data = files
         if files:
             print("Database was last saved", fmt_time(time.time() - self.hexbase.last_save), 'ago')
             print("Sucessfully loaded info on", len(files), 'files')
-        for pathname, info in files.items():
-            files[pathname] = Info(load=info, base=self.target)
+        self.replay(files)
+        size = FIELDS.index('size')
+        self.total_size = sum(row[size] or 0 for row in files.rows())
         return files
 
 
+    def replay(self, files):
+        "Apply the changes written by checkpoint() since the last full save"
+        if not os.path.exists(self.journal):
+            return
+        count = 0
+        with open(self.journal, 'rb') as f:
+            # Hashes from one algorithm are useless to a database that uses another
+            try:
+                header = hexbase.loads(f.readline())
+            except ValueError:
+                header = None
+            if not isinstance(header, dict) or header.get('hash') != self.hexbase.hashname:
+                print("Discarding the journal, it wasn't made with the", self.hexbase.hashname, "hash")
+                os.remove(self.journal)
+                return
+            for line in f:
+                try:
+                    fields, pfiles = hexbase.loads(line)
+                except ValueError:
+                    # Partly written line from a crash
+                    break
+                info = Info(load=fields, base=self.target)
+                files[info.pathname] = info
+                if pfiles:
+                    self.hexbase.pfiles[info.hash] = pfiles
+                count += 1
+        print("Recovered", count, "changes from the journal")
+
+
     def save(self, *args, **kargs):
-        out = dict()
-        for key, val in self.hexbase.data.items():
-            out[key] = val.tojson()
-        self.hexbase.save(out, *args, **kargs)
+        "Save one list per field, which is smaller and faster than a dict per file"
+        columns = zip(*self.files.rows()) if self.files else [[] for key in FIELDS]
+        out = dict(zip(FIELDS, map(list, columns)))
+        if not self.hexbase.save(out, *args, **kargs):
+            return False
+        # Everything in the journal is in the database now
+        self.dirty.clear()
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        return True
+
 
+    def processed(self, info):
+        "Mark info as changed and write the journal every CHECKPOINT_BYTES or CHECKPOINT_TIME"
+        self.dirty.add(info.pathname)
+        self.dirty_bytes += info.size or 0
+        if self.dirty_bytes >= CHECKPOINT_BYTES or tpc() - self.last_checkpoint >= CHECKPOINT_TIME:
+            self.checkpoint()
+
+
+    def checkpoint(self,):
+        "Append the files changed since the last checkpoint to the journal"
+        self.dirty_bytes = 0
+        self.last_checkpoint = tpc()
+        if not self.dirty:
+            return
+        # The journal shouldn't point to .par2 files that only exist in memory
+        self.hexbase.sync()
+        header = not os.path.exists(self.journal)
+        with open(self.journal, 'ab') as f:
+            if header:
+                # Rows are only good for the hash that made them, see replay()
+                f.write(hexbase.dumps(dict(hash=self.hexbase.hashname)) + b'\n')
+            for pathname in self.dirty:
+                info = self.files[pathname]
+                f.write(hexbase.dumps([info.tojson(), self.hexbase.pfiles.get(info.hash)]) + b'\n')
+            f.flush()
+            os.fsync(f)
+        self.dirty.clear()
 
-    def scan(self, scan_args, parity_args):
+
+    def scan(self, scan_args, parity_args, threads=1):
+        "Find files that need hashes or parity, stat'ing ahead with threads"
         newpars = []                # Files to process that meet reqs
         newhashes = dict()          # Files that need to be hashed
 
         start_time = tpc()
-        visited = 0
+        visited = set()             # Relative filenames seen by either walk
+        newhashes_size = 0          # Running totals, so they don't need to be summed again
+        newpars_size = 0
 
         def get_info(pathname):
-            '''Find the info for pathname'''
+            '''Find the info for pathname, using the stat from the walk for new files'''
             relpath = self.rel_path(pathname)
             if relpath in self.files:
                 # For existing files:
@@ -110,57 +255,75 @@ class Database:
                 info.pathname = relpath
             else:
                 # For new files
-                info = Info(relpath, base=self.target)
+                info = Info(relpath, base=self.target,
+                            stat=None if S_ISLNK(stat.st_mode) else stat)
                 self.files[relpath] = info
+                self.total_size += info.size
             return info
 
         def updated():
             "Check mtime and size vs one in database"
             if not info.hash:
                 return True
-            if stat.st_mtime != info.mtime:
-                return True
-            return False
+            if info.mtime_ns is None:
+                # Older databases only have the float mtime
+                return stat.st_mtime != info.mtime
+            return stat.st_mtime_ns != info.mtime_ns or stat.st_size != info.size
 
         # Scan all files
         print("\nScanning file tree:", self.target)
-        for pathname, stat in tree.Tree(self.target, scan_args).walk(yield_stat=True):
-            visited += 1
+        for pathname, stat in tree.Tree(self.target, scan_args).walk(yield_stat=True, threads=threads):
             info = get_info(pathname)
+            info.stat = stat
+            visited.add(info.pathname)
             if updated():
                 newhashes[pathname] = info
+                newhashes_size += stat.st_size
 
 
         # Look for files that need parity
-        for pathname, stat in tree.Tree(self.target, parity_args).walk(yield_stat=True):
+        for pathname, stat in tree.Tree(self.target, parity_args).walk(yield_stat=True, threads=threads):
             info = get_info(pathname)
+            visited.add(info.pathname)
             if updated() or info.hash not in self.hexbase.pfiles:
                 newpars.append(info)
-                if pathname in newhashes:
-                    newhashes.pop(pathname)
-                else:
-                    visited += 1
-
-
-        print("Done. Scanned", visited, 'files in', fmt_time(tpc() - start_time))
+                newpars_size += stat.st_size
+                if newhashes.pop(pathname, None):
+                    newhashes_size -= info.stat.st_size
+            info.stat = stat
+
+        self.visited |= visited
+        self.newhashes_size = newhashes_size
+        self.newpars_size = newpars_size
+        print("Done. Scanned", len(visited), 'files in', fmt_time(tpc() - start_time))
         return newpars, newhashes.values()
 
 
-    def get_hash(self, path):
+    def get_hash(self, path, keep_cache=False):
         "Hash a file and optional sleep for delay * read_time"
         if not self.delay:
-            return self.hexbase.get_hash(path)
+            return self.hexbase.get_hash(path, keep_cache=keep_cache, direct=self.direct)
         else:
             start = tpc()
-            result = self.hexbase.get_hash(path)
+            result = self.hexbase.get_hash(path, keep_cache=keep_cache, direct=self.direct)
             delay = (tpc() - start) * self.delay
             tprint("Sleeping for...", fmt_time(delay))
             time.sleep(delay)
             return result
 
 
+    def update(self, info):
+        "Update info from the file on disk and keep the total size current"
+        self.total_size -= info.size or 0
+        info.update()
+        self.total_size += info.size
+        self.dirty.add(info.pathname)
+
+
     def rel_path(self, pathname):
         "Return path of files relative to target directory"
+        if pathname.startswith(self.prefix):
+            return pathname[len(self.prefix):]
         return os.path.relpath(pathname, self.target)
 
 
@@ -172,22 +335,26 @@ class Database:
     def cleaner(self,):
         '''Clean database of non existant files'''
 
-        # Build list of hashes to info (could be multiples)
-        hashes = dict()
-        for info in self.files.values():
-            hashes.setdefault(info.hash, []).append(info)
+        # Build sets of info for each hash (could be multiples)
+        # and find the files that no longer exist in the same pass
+        hashes = collections.defaultdict(set)
+        removed = []
+        for pathname, info in self.files.items():
+            hashes[info.hash].add(info)
+            # Files seen by scan are known to exist
+            if pathname not in self.visited and not os.path.exists(self.fullpath(pathname)):
+                removed.append(pathname)
 
         # Look for hashes in the database that no longer correspond to .par2 files
         # then delete them
         deleted = 0
-        for pathname in list(self.files.keys()):
-            if not os.path.exists(self.fullpath(pathname)):
-                print('\nRemoving reference for', pathname)
-                info = self.files[pathname]
-                hashes[info.hash].remove(info)
-                if not hashes[info.hash]:
-                    deleted += self.hexbase.clean(info.hash)
-                del self.files[pathname]
+        for pathname in removed:
+            print('\nRemoving reference for', pathname)
+            info = self.files.pop(pathname)
+            self.total_size -= info.size or 0
+            hashes[info.hash].discard(info)
+            if not hashes[info.hash]:
+                deleted += self.hexbase.clean(info.hash)
 
         # Remove Stray .par2 files caused by files being updated
         for fhash, _ in list(self.hexbase.pfiles.items()):
@@ -200,17 +367,21 @@ class Database:
 
 
 
-    def verify(self,):
-        "Verify files in directory"
+    def verify(self, quick=False, threads=1):
+        """Verify files in directory
+        quick = Trust files with the same size, mtime, inode and ctime as when they were hashed
+        threads = Number of files to hash at once"""
 
         # Look for files with errors
         file_errors = []                # List of files with errors in them
         updated = 0                     # Files updated on the disk, but not in database
+        trusted = 0                     # Files skipped in quick mode
 
         print('\nVerifying hashes of all files referenced in database:')
 
-        fp = FileProgress(len(self.files), sum(info.size for info in self.files.values()))
+        fp = FileProgress(len(self.files), self.total_size)
         missing = 0         # Files with missing hashes
+        tohash = []         # Files that passed the checks below
         for relpath, info in self.files.items():
             if not info.hash:
                 missing += 1
@@ -218,26 +389,40 @@ class Database:
 
             fullpath = info.fullpath
             # Files deleted from disk continue to exist in database until cleaner is run
-            if not os.path.exists(fullpath):
+            try:
+                stat = os.stat(fullpath)
+            except FileNotFoundError:
                 continue
             if cant_read(fullpath):
                 continue
 
-            tprint(fp.progress(filename=fullpath)['default'] + ':', relpath)
-
-            if os.path.getmtime(info.fullpath) > info.mtime + 1e-3:
+            if stat.st_mtime > info.mtime + 1e-3:
                 updated += 1
                 print("File updated on disk without being rescanned:", relpath)
                 continue
 
-            if not hexbase.hash_cmp(info.hash, self.get_hash(info.fullpath)):
-                print(info, vars(info))
-                print("\n\nError in file!", relpath)
-                file_errors.append(relpath)
+            if quick and info.unchanged(stat):
+                trusted += 1
+                continue
+            tohash.append(info)
+
+        # Hashing releases the GIL, so threads can read several files at once
+        hashes = map_ahead(lambda info: self.get_hash(info.fullpath), tohash, threads)
+        for info, fhash in zip(tohash, hashes):
+            tprint(fp.progress(info.size, filename=info.fullpath)['default'] + ':', info.pathname)
+            if not hexbase.hash_cmp(info.hash, fhash):
+                print(info, info.tojson())
+                print("\n\nError in file!", info.pathname)
+                file_errors.append(info.pathname)
 
         tprint("Done. Hashed", fp.done()['msg'])
         print()
 
+        if trusted:
+            print('\n')
+            print(trusted, 'files were unchanged since they were hashed and not read.')
+            print("Run with --verify to check them for corruption.")
+
         if missing:
             print('\n')
             print(missing, 'files had no hash in the database')
@@ -289,136 +474,227 @@ class Database:
 
         if info.repair(dest_files):
             info.hash = self.get_hash(info.fullpath)
-            info.update()
+            self.update(info)
             print("File fixed!\n\n")
             return True
         return False
 
 
-    def gen_hashes(self, newhashes):
-        "Generate new hashes for files."
-        data2process = sum(info.size for info in newhashes)
+    def gen_hashes(self, newhashes, threads=1, data2process=None):
+        """Generate new hashes for files.
+        threads = Number of files to hash at once
+        data2process = Total size of newhashes, if already known"""
+        if data2process is None:
+            data2process = sum(info.size for info in newhashes)
         fp = FileProgress(len(newhashes), data2process)
         print("\nCreating only hashes for",
               len(newhashes), 'files spanning', rfs(data2process))
 
-
-        def interrupt(*_):
-            print("\n\nCaught ctrl-c!")
-            print("Saving database, please wait...")
-            self.save()
-            sys.exit(0)
-
-        signal.signal(signal.SIGINT, interrupt)     # Catch Ctrl-C
-        for info in newhashes:
-            size = info.size
-            tprint("File", fp.progress(size)['default'] + ':', info.pathname)
-            info.hash = self.get_hash(info.fullpath)
-            info.update()
-        signal.signal(signal.SIGINT, lambda *args: sys.exit(1))
+        def hash_file(info):
+            if self.stop_requested.is_set():
+                return None
+            return self.get_hash(info.fullpath)
+
+        hashes = map_ahead(hash_file, newhashes, threads)
+        for info, fhash in zip(newhashes, hashes):
+            if fhash is None:
+                break
+            tprint("File", fp.progress(info.size)['default'] + ':', info.pathname)
+            info.hash = fhash
+            self.update(info)
+            self.processed(info)
+        hashes.close()
 
         tprint("\nDone. Processed", fp.done()['msg'])
         print()
 
 
-    def gen_pars(self, newpars, sequential=False, singlecharfix=False, par2_options=None):
+    def gen_pars(self, newpars, sequential=False, singlecharfix=False, par2_options=None,
+                 data2process=None, jobs=1):
         '''Rehash files and Generate new .par2 files
         sequential      = Run in sequential mode (generate hash first, then parity)
         singlecharfix   = Rename files before running par2
         par2_options    = Passed onto par2 program
+        data2process    = Total size of newpars, if already known
+        jobs            = Number of par2 processes to run at once
         '''
 
-        data2process = sum(info.size for info in newpars)
+        if data2process is None:
+            data2process = sum(info.size for info in newpars)
         print("\nCreating parity and hashes for",
               len(newpars), 'files spanning', rfs(data2process))
 
+        # Process files in inode order which roughly follows their layout on disk, reducing seeks
+        newpars.sort(key=lambda info: (info.stat.st_dev, info.stat.st_ino))
+
         fp = FileProgress(len(newpars), data2process)
-        results = []
-        for count, info in enumerate(newpars):
-            # + = multi - = sequential     '+-'[sequential],
-            size = info.size
-            tprint("File", fp.progress(size)['default'] + ':', info.pathname)
+        early_quits = 0             # Consecutive files that already had .par2 files
 
-            status, files = self.generate(info, sequential, singlecharfix, par2_options)
+        def finish(info, status, files):
+            "Store the results of generate, called from this thread only"
+            nonlocal early_quits, sequential
             if status:
-                info.update()
-            results.append(status)
+                self.update(info)
+            early_quits = early_quits + 1 if status == 'PARALLEL_EARLY_QUIT' else 0
 
             for number, name in enumerate(files):
                 self.hexbase.put(name, info.hash, '.' + str(number) + '.par2')
 
 
-            if not sequential and results[-5:] == ['PARALLEL_EARLY_QUIT'] * 5:
+            if not sequential and early_quits >= 5:
                 print("Too many files with existing .par2... switch to sequential mode.")
                 sequential = True
 
+            # Only the changes are written, the whole database is saved at the end
+            self.processed(info)
+
+
+        if jobs > 1:
+            # Each job gets its own slot, so par2 files in the same folder get different names.
+            # A slot is only reused after its .par2 files have been moved into the database.
+            slots = queue.Queue()
+            for slot in range(jobs):
+                slots.put(slot)
+
+            # Files with the same contents must not make parity at the same time,
+            # or the second put would replace the first instead of being skipped.
+            lock = threading.Lock()
+            inflight = set()                        # Hashes a job is making parity for
+            twins = collections.defaultdict(list)   # hash: files waiting on that job
+
+            def claim(fhash):
+                "Called by generate once the hash is known, False if another job has it"
+                with lock:
+                    if fhash in inflight:
+                        return False
+                    inflight.add(fhash)
+                    return True
+
+            def work(info):
+                slot = slots.get()
+                return (slot,) + self.generate(info, sequential, singlecharfix, par2_options,
+                                               slot=slot, claim=claim)
+
+            # Only trust the hash in the database if the file hasn't changed since
+            todo = collections.deque((info, info.hash if info.unchanged(info.stat) else None)
+                                     for info in newpars)
+            running = dict()
+            with ThreadPoolExecutor(jobs) as pool:
+                while todo or running:
+                    # Submit only as jobs free up, so the hexbase is current when checked
+                    while todo and len(running) < jobs and not self.stop_requested.is_set():
+                        info, fhash = todo.popleft()
+                        if fhash and fhash in self.hexbase.pfiles:
+                            # Already has parity, but record the stat so it isn't rehashed next run
+                            tprint("File", fp.progress(info.size)['default'] + ':', info.pathname)
+                            finish(info, True, [])
+                        elif fhash and fhash in inflight:
+                            twins[fhash].append(info)
+                        else:
+                            running[pool.submit(work, info)] = info
+                    if not running:
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        info = running.pop(future)
+                        slot, status, files = future.result()
+                        slots.put(slot)
+                        if status == 'DEFERRED':
+                            twins[info.hash].append(info)
+                            if info.hash in inflight:
+                                continue
+                        else:
+                            tprint("File", fp.progress(info.size)['default'] + ':', info.pathname)
+                            finish(info, status, files)
+                            with lock:
+                                inflight.discard(info.hash)
+                        # Retry the twins now that the parity is stored (or failed)
+                        todo.extendleft((twin, info.hash) for twin in twins.pop(info.hash, []))
 
-            # Save every hour
-            if not count % 10:
-                if self.save(mintime=3600):
-                    print("Database saved successfuly at", time.strftime('%H:%M'))
-
-            if len(results) > 5:
-                results.pop(0)
+        else:
+            ahead = None                # Hash of the next file, computed while par2 runs
+            for count, info in enumerate(newpars):
+                if self.stop_requested.is_set():
+                    break
+                # + = multi - = sequential     '+-'[sequential],
+                size = info.size
+                tprint("File", fp.progress(size)['default'] + ':', info.pathname)
+
+                # In sequential mode, hash the next file while par2 works on this one
+                fhash = ahead() if ahead else None
+                ahead = None
+                if sequential and not self.delay and count + 1 < len(newpars):
+                    ahead = prefetch(self.get_hash, newpars[count + 1].fullpath, True)
+
+                status, files = self.generate(info, sequential, singlecharfix, par2_options, fhash)
+                finish(info, status, files)
 
         tprint("\nDone. Processed", fp.done()['msg'])
         print()
         return True
 
 
-    def generate(self, info, sequential=False, singlecharfix=False, par2_options=None):
+    def generate(self, info, sequential=False, singlecharfix=False, par2_options=None, fhash=None,
+                 slot=0, claim=None):
         '''Generate par2 or find existing, return True on new files
             sequential = Hash the file first, before running par2 (instead of in parallel)
             singlecharfix = Temporarily replace single character file names
             par2_options = Options for par2 command
+            fhash = Hash of the file, if already known (sequential mode only)
+            slot = Number used to name the temporary .par2 files when running several at once
+            claim = Function called with the hash before running par2, returns False to defer
         '''
-        ret = None
+        tmpname = tmp_name(slot)
         old_name = info.fullpath                        # Original base filename
         new_name = old_name                             # Modified name
-        if singlecharfix and len(os.path.basename(old_name)) == 1:
+        needs_rename = singlecharfix and len(os.path.basename(old_name)) == 1
+        if needs_rename:
+            # Fix 1 char filenames
             new_name = old_name + '.pardatabase.tmp.rename'
-
-        def interrupt(*_):
-            print("\n\nCaught ctrl-c!")
-            rename(new_name, old_name)
-            if ret:
-                ret.kill()
-            print("Saving database, please wait...")
-            self.save()
-            info.remove_existing()
-            print("Done")
-            sys.exit(0)
-
-
-        def rename(old, new, verbose=False):
-            "Swap name old for new"
-            if old != new:
-                os.rename(os.path.join(self.target, old), os.path.join(self.target, new))
-                info.pathname = new
-                if verbose:
-                    print("File name restored:", new)
+            rename_noreplace(old_name, new_name)
 
         # Finish before get_hash in sequential mode or run in parallel
-        signal.signal(signal.SIGINT, interrupt)     # Catch Ctrl-C
-        rename(old_name, new_name)                  # Fix 1 char filenames (if needed)
-        if sequential:
-            info.hash = self.get_hash(new_name)
-            if info.hash in self.hexbase.pfiles:
-                rename(new_name, old_name)
-                return False, []
-            code = info.run_par2(par2_options, new_name).wait()
-        else:
-            ret = info.run_par2(par2_options, new_name)
-            info.hash = self.get_hash(new_name)
-            if info.hash in self.hexbase.pfiles:
-                ret.terminate()
-                info.remove_existing()
-                rename(new_name, old_name)
-                return 'PARALLEL_EARLY_QUIT', []
+        # par2 needs a real file to read, not a pipe, so in parallel mode the hash and par2
+        # read the file at the same time and whichever is behind gets it from the page cache.
+        try:
+            if sequential:
+                info.hash = fhash if fhash else self.get_hash(new_name, keep_cache=True)
+                if self.stop_requested.is_set():
+                    return False, []
+                if info.hash in self.hexbase.pfiles:
+                    # Same contents as a file with parity, only its stat needs updating
+                    return 'EXISTING', []
+                if claim and info.hash and not claim(info.hash):
+                    return 'DEFERRED', []
+                code = info.run_par2(par2_options, new_name, tmpname=tmpname).wait()
             else:
-                code = ret.wait()
-        rename(new_name, old_name)                  # Swap name back
-        signal.signal(signal.SIGINT, lambda *args: sys.exit(1))
+                ret = info.run_par2(par2_options, new_name, tmpname=tmpname)
+                info.hash = self.get_hash(new_name, keep_cache=True)
+                if self.stop_requested.is_set():
+                    ret.terminate()
+                    ret.wait()
+                elif info.hash in self.hexbase.pfiles:
+                    ret.terminate()
+                    info.remove_existing(tmpname)
+                    return 'PARALLEL_EARLY_QUIT', []
+                elif claim and info.hash and not claim(info.hash):
+                    # Another job has the same hash, try again once its parity is stored
+                    ret.terminate()
+                    info.remove_existing(tmpname)
+                    return 'DEFERRED', []
+                else:
+                    code = ret.wait()
+        finally:
+            if needs_rename:
+                rename_noreplace(new_name, old_name)    # Swap name back
+            # Hashed with keep_cache for par2, but neither will read it again
+            hexbase.drop_cache(old_name)
+
+        # Ctrl-c also reaches par2, so don't keep its partial output
+        if self.stop_requested.is_set():
+            info.remove_existing(tmpname)
+            return False, []
 
         # File read error or par2 error
         if code:
@@ -428,4 +704,4 @@ class Database:
         if not info.hash or code:
             return False, []
 
-        return True, info.find_tmp()
+        return True, list(info.find_tmp(tmpname))
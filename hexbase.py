@@ -2,18 +2,30 @@
 import os
 import time
 import lzma
+import mmap
 import json
+import queue
+import sys
 import shutil
 import hashlib
+import threading
 
 from sd.rotate import rotate
 from sd.file_progress import FileProgress, tprint
 
+# Faster json if available
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
 BAK_NUM = 8     # Number of database backups
 TRUNCATE = 64   # Hashes are truncated to 64 hex = 256 bits for space savings in database.xz
-                # Not using sha256 because truncated sha512 is better and faster.
-VERSION = 1.2   # Database version number
+                # Not using sha256 because truncated sha512 is better and faster,
+                # unless the cpu has sha256 instructions.
+VERSION = 1.3   # Database version number
 MINHASH = 16    # Minimum size of hash = 64 bits
+DIRECT_MIN = 256 * 1024**2      # Minimum file size to read with O_DIRECT when requested
 
 assert(TRUNCATE) >= MINHASH
 
@@ -28,6 +40,142 @@ def user_answer(text='Y/N ?'):
             return True
 
 
+def dumps(obj):
+    "Return obj as json bytes"
+    if orjson:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson refuses the lone surrogates that python uses for non utf-8 filenames
+            pass
+    return json.dumps(obj).encode()
+
+
+def loads(data):
+    "Load json from bytes or str"
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Escaped surrogates written by json.dumps above
+            pass
+    return json.loads(data)
+
+
+def fadvise(fd, *advice):
+    "Tell the kernel how a file will be read, if the platform supports it"
+    if hasattr(os, 'posix_fadvise'):
+        for name in advice:
+            os.posix_fadvise(fd, 0, 0, getattr(os, 'POSIX_FADV_' + name))
+
+
+def sha_extensions():
+    "Does the cpu have sha256 instructions? (x86 sha_ni or ARMv8 sha2)"
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    return bool(flags & {'sha_ni', 'sha2'})
+
+
+def get_hashfunc(name):
+    "Return the constructor for a hash name in hashlib or the optional blake3 package"
+    if name == 'blake3':
+        from blake3 import blake3       # pylint: disable=C0415
+        return blake3
+    if name in vars(hashlib):
+        return vars(hashlib)[name]
+    hashlib.new(name)                   # Raise ValueError for unknown hashes
+    return lambda *data: hashlib.new(name, *data)
+
+
+def hash_speed(hashfunc, size=64 * 1024 * 1024):
+    "Return the bytes per second hashfunc can process from memory"
+    data = bytes(size)
+    start = time.perf_counter()
+    hashfunc(data).hexdigest()
+    return size / (time.perf_counter() - start)
+
+
+def fsync(path):
+    "Flush a file or folder to disk"
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def drop_cache(path):
+    "Tell the kernel a file won't be read again, so it can leave the page cache"
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        fadvise(fd, 'DONTNEED')
+    finally:
+        os.close(fd)
+
+
+def open_direct(path, fd):
+    "Swap fd for one opened with O_DIRECT if possible, return the fd and if it was swapped"
+    if not hasattr(os, 'O_DIRECT'):
+        return fd, False
+    try:
+        dfd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+    except OSError:
+        # Some filesystems (like tmpfs) don't support it
+        return fd, False
+    os.close(fd)
+    return dfd, True
+
+
+def hash_ahead(m, fd, chunk, aligned=False):
+    """Update hash object m with the file at fd using two reusable buffers:
+    one is filled by a thread while the other is being hashed
+    aligned = Use page aligned buffers, as needed by O_DIRECT"""
+    full = queue.Queue()                # Buffers waiting to be hashed
+    free = queue.Queue()                # Buffers waiting to be filled
+    for _ in range(2):
+        # Anonymous maps always start on a page boundary, unlike bytearray
+        free.put(mmap.mmap(-1, chunk) if aligned else bytearray(chunk))
+
+    stop = threading.Event()            # Set when the hasher is done with the file
+
+    def reader():
+        try:
+            while True:
+                buf = free.get()
+                if stop.is_set():
+                    return
+                size = os.readv(fd, [buf])
+                full.put((buf, size))
+                if not size:
+                    return
+        except OSError as err:
+            full.put((err, 0))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            buf, size = full.get()
+            if isinstance(buf, OSError):
+                raise buf
+            if not size:
+                return
+            # Hash straight out of the buffer without copying it into a new bytes object
+            m.update(memoryview(buf)[:size])
+            free.put(buf)
+    finally:
+        # Make sure the reader is finished before the caller closes the file
+        stop.set()
+        free.put(None)
+        thread.join()
+
+
 def hash_cmp(aaa, bbb):
     "Compare hashes of unequal length"
     length = min(len(aaa), len(bbb))
@@ -49,10 +197,12 @@ class HexBase:
         self.pfiles = dict()                    # hashes to dict(par file name : hash of par file)
         self.data = dict()                      # Anything that can be serialized into json
         self.last_save = 0                      # Last save time
+        self.unsynced = set()                   # .par2 files put() since the last sync()
         self.version = VERSION                  # Database version number
 
         self.hashfunc = hashlib.sha512
         self.hashname = 'sha512'                # Custom user hash
+        self.hashproto = self.hashfunc()        # Empty hash object to copy for each file
         self.hexes = [(('0' + hex(num)[2:])[-2:]).upper() for num in range(0, 256)]
 
 
@@ -78,8 +228,8 @@ class HexBase:
         for path in baks:
             if os.path.exists(path):
                 try:
-                    with lzma.open(path, mode='rt') as f:
-                        meta, self.data, self.pfiles = json.load(f)
+                    with lzma.open(path, mode='rb') as f:
+                        meta, self.data, self.pfiles = loads(f.read())
                         if meta['hash']:
                             self.hashname = meta['hash']
                         self.version = meta['version']
@@ -95,15 +245,31 @@ class HexBase:
                 rotate(self.index, limit=BAK_NUM)
             if hashname:
                 self.hashname = hashname
+            elif sha_extensions():
+                # With hardware support sha256 is faster than sha512
+                self.hashname = 'sha256'
+
+        if good and hashname and hashname != self.hashname:
+            print("Database already uses the", self.hashname, "hash, ignoring:", hashname)
 
         if self.hashname and self.hashname != 'sha512':
             print("Using custom hash:", self.hashname)
-            self.hashfunc = vars(hashlib)[self.hashname]
+            try:
+                self.hashfunc = get_hashfunc(self.hashname)
+            except ImportError:
+                # An existing database made with blake3 can't be read without it
+                print("Install blake3 with: pip install blake3")
+                sys.exit(1)
+            self.hashproto = self.hashfunc()
 
         if self.version < 1.2:
             # Added hash truncation
             self.version = 1.2
 
+        if self.version < 1.3:
+            # Files are saved in columns from now on
+            self.version = 1.3
+
 
     def save(self, data=None, mintime=0):
         "Save the database in lzma which adds a nice checksum and rotate"
@@ -111,11 +277,14 @@ class HexBase:
         if mintime and time.time() - self.last_save < mintime:
             return False
 
+        # The database shouldn't point to .par2 files that only exist in memory
+        self.sync()
+
         # Rotate any old backup files
         baks = rotate(self.index, limit=BAK_NUM)
 
         # Save to file
-        with lzma.open(self.index, mode='wt', check=lzma.CHECK_CRC64, preset=2) as f:
+        with lzma.open(self.index, mode='wb', check=lzma.CHECK_CRC64, preset=2) as f:
             meta = dict(mtime=time.time(),      # modification time
                         hash=self.hashname,     # hash choice
                         encoding='hex',         # encode hash as hexadecimal
@@ -124,7 +293,7 @@ class HexBase:
                        )
 
 
-            json.dump([meta, data, self.pfiles], f)
+            f.write(dumps([meta, data, self.pfiles]))
             self.last_save = time.time()
             f.flush()
             os.fsync(f)
@@ -176,11 +345,24 @@ class HexBase:
             # print("Overwriting existing file:", dest)
             os.remove(dest)
         shutil.move(src, dest)
+        self.unsynced.add(dest)
         if fhash not in self.pfiles:
             self.pfiles[fhash] = dict()
         self.pfiles[fhash][oname] = phash
 
 
+    def sync(self,):
+        "Flush the .par2 files from put() to disk, then each of their folders once"
+        folders = set()
+        for path in self.unsynced:
+            if os.path.exists(path):
+                fsync(path)
+                folders.add(os.path.dirname(path))
+        for folder in folders:
+            fsync(folder)
+        self.unsynced.clear()
+
+
 
     def get(self, fhash, cwd):
         "Given a hash, copy files from vault and put them in cwd"
@@ -209,24 +391,45 @@ class HexBase:
 
 
 
-    def get_hash(self, path, chunk=4 * 1024 * 1024):
-        "Get sha512 of filename"
-        m = self.hashfunc()
-        with open(path, 'rb') as f:
-            while True:
-                try:
-                    data = f.read(chunk)
-                except IOError as err:
-                    print('\nIO Error in', path)
-                    print(err)
-                    return 'ioerror'
-                if data:
-                    m.update(data)
+    def get_hash(self, path, chunk=4 * 1024 * 1024, keep_cache=False, direct=False):
+        """Get sha512 of filename
+        keep_cache = Leave the file in the page cache for the next reader (like par2)
+        direct = Read large files with O_DIRECT, bypassing the page cache entirely"""
+        m = self.hashproto.copy()
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fadvise(fd, 'SEQUENTIAL')
+            size = os.fstat(fd).st_size
+            aligned = False
+            if direct and not keep_cache and size >= DIRECT_MIN:
+                fd, aligned = open_direct(path, fd)
+            if size <= chunk:
+                # Small files aren't worth starting a thread for
+                if hasattr(hashlib, 'file_digest'):
+                    # Python 3.11+ reads into one reused buffer without leaving C
+                    with open(fd, 'rb', buffering=0, closefd=False) as f:
+                        m = hashlib.file_digest(f, m.copy)
                 else:
-                    # return m.hexdigest()[:2] + base64.urlsafe_b64encode(m.digest()[1:]).decode()
-                    # on disks savings of 10596 vs 11892 = 11% after lzma compression
-                    # may be useful for in memory savings in future
-                    return m.hexdigest()[:TRUNCATE]
+                    for data in iter(lambda: os.read(fd, chunk), b''):
+                        m.update(data)
+            else:
+                # Not mmap: a bad sector under a mapping kills the program with SIGBUS
+                # instead of raising the IOError below, and finding those is the point.
+                hash_ahead(m, fd, chunk, aligned)
+        except IOError as err:
+            print('\nIO Error in', path)
+            print(err)
+            return 'ioerror'
+        finally:
+            if not keep_cache:
+                # Don't leave files that were only read once clogging up the page cache
+                fadvise(fd, 'DONTNEED')
+            os.close(fd)
+
+        # return m.hexdigest()[:2] + base64.urlsafe_b64encode(m.digest()[1:]).decode()
+        # on disks savings of 10596 vs 11892 = 11% after lzma compression
+        # may be useful for in memory savings in future
+        return m.hexdigest()[:TRUNCATE]
 
 
     def verify(self,):
@@ -256,3 +459,5 @@ class HexBase:
 
 # Version History
 # 1.1 Store relative pathname for files instead now. Requires fix for old pathnames
+# 1.2 Hashes truncated to TRUNCATE hex digits
+# 1.3 File info saved as one list per field instead of one dict per file
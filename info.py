@@ -1,53 +1,87 @@
 #!/usr/bin/python3
 
 import os
+import sys
 import subprocess
+from collections.abc import MutableMapping
 
 TMPNAME = '.pardatabase_tmp_file'       # Temporary file used when generating .par2
+FIELDS = ('pathname', 'hash', 'mtime', 'size', 'mtime_ns', 'ino', 'dev', 'ctime_ns')  # Saved in database
 
 class Info:
     "Info on filepaths within system"
 
-    def __init__(self, pathname=None, load=None, base='.'):
+    # No __dict__ for each of the (possibly millions) of files
+    __slots__ = FIELDS + ('stat', 'fullpath', 'cwd')
+
+    def __init__(self, pathname=None, load=None, base='.', stat=None):
+
+        self.pathname = pathname            # Relative path (can be changed between runs)
+        self.hash = None
+        self.mtime = None
+        self.size = None
+        self.mtime_ns = None                # Exact mtime when last updated
+        self.ino = None                     # Inode number when last updated
+        self.dev = None                     # Device number when last updated
+        self.ctime_ns = None                # Inode change time when last updated
+        self.stat = None                    # Stat from the last scan (not saved)
 
         if load:
             # Load from json dict
             for key, val in load.items():
-                setattr(self, key, val)
-        else:
-            self.pathname = pathname        # Relative path (can be changed between runs)
-            self.hash = None
-            self.mtime = None
-            self.size = None
+                if key in FIELDS:
+                    setattr(self, key, val)
+            if self.hash:
+                # Files with the same contents share one string
+                self.hash = sys.intern(self.hash)
 
         self.fullpath = os.path.join(base, self.pathname)
-        self.cwd = os.path.dirname(self.fullpath)
+        self.cwd = sys.intern(os.path.dirname(self.fullpath))     # Shared by files in a folder
 
         if not load:
-            self.update()
+            self.update(stat)
 
 
     def tojson(self,):
         "Return neccesary variables as compact json dict."
-        return {key:val for key, val in vars(self).items() if key in ['pathname', 'hash', 'mtime', 'size']}
-
-
-    def update(self,):
-        "Update file size and mtime"
-        self.mtime = os.path.getmtime(self.fullpath)
-        self.size = os.path.getsize(self.fullpath)
-
-
-    def find_tmp(self,):
+        return {key: getattr(self, key) for key in FIELDS}
+
+
+    def update(self, stat=None):
+        "Update file size, mtime, inode, device and ctime from stat or the file on disk"
+        if stat is None:
+            stat = os.stat(self.fullpath)
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.ino = stat.st_ino
+        self.dev = stat.st_dev
+        self.ctime_ns = stat.st_ctime_ns
+
+
+    def unchanged(self, stat):
+        """Does the stat match the size, mtime, inode, device and ctime recorded at the last update?
+        ctime can't be set by the user, so it catches edits that put the mtime back"""
+        if self.mtime_ns is None:
+            return False
+        if (stat.st_size, stat.st_mtime_ns, stat.st_ino) != (self.size, self.mtime_ns, self.ino):
+            return False
+        if self.ctime_ns is None:
+            # Older databases didn't record these
+            return True
+        return (stat.st_dev, stat.st_ctime_ns) == (self.dev, self.ctime_ns)
+
+
+    def find_tmp(self, tmpname=TMPNAME):
         "Find existing par2 tmp files"
         for name in os.listdir(self.cwd):
-            if name.endswith('.par2') and name.startswith(TMPNAME):
+            if name.endswith('.par2') and name.startswith(tmpname + '.'):
                 yield os.path.join(self.cwd, name)
 
 
-    def remove_existing(self,):
+    def remove_existing(self, tmpname=TMPNAME):
         "Delete leftover .par2 files"
-        for name in self.find_tmp():
+        for name in self.find_tmp(tmpname):
             print("Removing existing par2 file:", name)
             os.remove(name)
 
@@ -64,16 +98,66 @@ class Info:
         return status
 
 
-    def run_par2(self, par2_options, name, verbose=False):
+    def run_par2(self, par2_options, name, verbose=False, tmpname=TMPNAME):
         '''Run par2 command
         par2_options are passed to par2
         name is the alterate name in case the file needs to be renamed
+        tmpname is the name of the .par2 files created
         '''
-        self.remove_existing()
+        self.remove_existing(tmpname)
         cmd = "par2 create -n1 -qq".split()
         if par2_options:
             cmd.extend(('-' + par2_options).split())
-        cmd += ['-a', TMPNAME + '.par2', '--', os.path.basename(name)]
+        cmd += ['-a', tmpname + '.par2', '--', os.path.basename(name)]
         if verbose:
             print(' '.join(cmd))
         return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, cwd=self.cwd)
+
+
+
+class LazyInfoDict(MutableMapping):
+    "Dict of pathname to Info, which only builds an Info the first time it is looked up"
+
+    def __init__(self, rows=(), base='.'):
+        self.base = base
+        self.data = {}          # pathname to Info or a tuple of FIELDS not looked at yet
+        for row in rows:
+            self.data[row[0]] = row
+
+
+    def __getitem__(self, pathname):
+        info = self.data[pathname]
+        if not isinstance(info, Info):
+            info = Info(load=dict(zip(FIELDS, info)), base=self.base)
+            self.data[pathname] = info
+        return info
+
+
+    def __setitem__(self, pathname, info):
+        self.data[pathname] = info
+
+
+    def __delitem__(self, pathname):
+        del self.data[pathname]
+
+
+    def __contains__(self, pathname):
+        # Without this, MutableMapping would build the Info to find out
+        return pathname in self.data
+
+
+    def __iter__(self):
+        return iter(self.data)
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+    def rows(self,):
+        "Yield a tuple of FIELDS for every file, without building an Info for each"
+        for info in self.data.values():
+            if isinstance(info, Info):
+                yield tuple(getattr(info, key) for key in FIELDS)
+            else:
+                yield info
@@ -6,8 +6,10 @@ import os
 import sys
 import time
 import shutil
+import signal
 
 import sd.tree as tree
+import hexbase
 import sd.easy_args as ea
 from database import Database
 from sd.format_number import rfs
@@ -65,12 +67,23 @@ def parse_args():
     More options can be found by typing: man par2''',
     ['sequential', '', bool],
     "Hash the file before running par2 (instead of running in parallel)",
+    ['direct', '', bool],
+    "Read files over 256M with O_DIRECT when only hashing, so they don't fill the page cache.",
+    ['jobs', '', int, 1],
+    "Number of par2 processes to run at once, 0 = half the cpus.",
     ['delay', '', float],
     "Wait for (delay * read_time) after every read to keep drive running cooler.",
     ['verify', '', bool],
     "Verify existing files by comparing the hash",
+    ['quickverify', '', bool],
+    "Like --verify, but trust files with the same size, mtime, inode and ctime as when they were hashed.",
+    ['threads', '', int, 1],
+    "Files to hash (without parity) and folders to scan at once. Helps SSDs, RAID and network drives.",
     ['repair', '', str],
     "Repair an existing file",
+    ['hash', '', str],
+    '''Hash used by a new database, for example: sha256, sha512 or blake3 (pip install blake3)
+    Defaults to sha256 on cpus with sha instructions, otherwise sha512.''',
     ['verbose', '', bool],
     "Useful for debugging.",
     ]
@@ -161,11 +174,24 @@ def fix_args(args):
         if args[arg]:
             args[arg] = ConvertDataSize()(args[arg])
 
+    if args['jobs'] <= 0:
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        args['jobs'] = max(cpus // 2, 1)
+
+    if args['hash']:
+        try:
+            hexbase.get_hashfunc(args['hash'])().hexdigest()
+        except ImportError:
+            print("Install blake3 with: pip install blake3")
+            return False
+        except (ValueError, TypeError):
+            print("Unsupported hash:", args['hash'])
+            return False
+
     return args
 
 
-def spanning(files):
-    data2process = sum(info.size for info in files)
+def spanning(files, data2process):
     return str(len(files)) + ' files spanning ' + rfs(data2process)
 
 
@@ -181,11 +207,19 @@ def main():
             sys.exit(0)
 
     os.nice(uargs['nice'])
-    db = Database(uargs['basedir'], uargs['target'],)
+    db = Database(uargs['basedir'], uargs['target'], hashname=uargs['hash'])
     db.delay = uargs['delay'] if uargs['delay'] else db.delay
+    db.direct = uargs['direct']
+
+    if uargs['verbose']:
+        speed = hexbase.hash_speed(db.hexbase.hashfunc)
+        print("Hashing speed:", rfs(speed) + '/s')
+        if speed < 500e6:
+            print("Slow hashing, try --hash blake3 on new databases or a Python",
+                  "built against a newer OpenSSL that uses the cpu's sha instructions.")
 
     # Make sure the database exists for key operations
-    if any([uargs[key] for key in uargs if key in ('repair', 'verify', 'clean')]):
+    if any([uargs[key] for key in uargs if key in ('repair', 'verify', 'quickverify', 'clean')]):
         if not db.files:
             print("There is no pardatabase for", db.target)
             print("Run again without any --options to generate one.")
@@ -198,10 +232,10 @@ def main():
         dryrun()
         return db.repair(uargs['repair'])
 
-    if uargs['verify']:
+    if uargs['verify'] or uargs['quickverify']:
         # Verify files in database
         dryrun()
-        return db.verify()
+        return db.verify(quick=uargs['quickverify'], threads=uargs['threads'])
 
     if uargs['clean']:
         # Check for files deleted from database
@@ -226,25 +260,39 @@ def main():
     if uargs['verbose']:
         print('\nScan_args:', scan_args)
         print('\nParity_args:', parity_args)
-    newpars, newhashes = db.scan(scan_args, parity_args)
+    newpars, newhashes = db.scan(scan_args, parity_args, threads=uargs['threads'])
 
     if (newpars and newhashes) or uargs['dryrun']:
         print("\nBased on the options selected:")
-        print(spanning(newhashes), "will be hashed without parity")
-        print(spanning(newpars), "will be both hashed and have parity files created")
+        print(spanning(newhashes, db.newhashes_size), "will be hashed without parity")
+        print(spanning(newpars, db.newpars_size), "will be both hashed and have parity files created")
 
     dryrun()
+
+    def interrupt(*_):
+        "Let the current file finish, then save and quit. A second ctrl-c quits immediately."
+        if db.stop_requested.is_set():
+            sys.exit(1)
+        print("\n\nCaught ctrl-c! Finishing the current file, ctrl-c again to quit without saving.")
+        db.stop_requested.set()
+
+    signal.signal(signal.SIGINT, interrupt)
+
     # Hash files without creating parity
     if newhashes:
-        db.gen_hashes(newhashes)
+        db.gen_hashes(newhashes, threads=uargs['threads'], data2process=db.newhashes_size)
 
     # Generate new parity files
-    if newpars:
+    if newpars and not db.stop_requested.is_set():
         db.gen_pars(newpars,
                     sequential=uargs['sequential'],
                     singlecharfix=uargs['singlecharfix'],
-                    par2_options=uargs['options'])
+                    par2_options=uargs['options'],
+                    data2process=db.newpars_size,
+                    jobs=uargs['jobs'])
 
+    if db.stop_requested.is_set():
+        print("Saving database, please wait...")
     if newhashes or newpars:
         db.save()
     return True
@@ -1,11 +1,21 @@
 #!/usr/bin/python3
 #
+import re
+import math
+
+# The number and unit of one term like "10.5G" or "80%"
+_TERM = re.compile(r'(\d+\.?\d*|\.\d+)\s*([KMGTPEZY%]?)')
+_SIGN = re.compile(r'([+-])')
+_POWERS = {unit: power for power, unit in enumerate(' KMGTPEZY')}
+_POWERS[''] = 0
+
 
 def is_num(num):
     "Is the string a number?"
-    if str(num).strip().replace('.', '', 1).replace('e', '', 1).isdigit():
-        return True
-    return False
+    try:
+        return math.isfinite(float(num))
+    except (TypeError, ValueError):
+        return False
 
 
 class ConvertDataSize():
@@ -20,44 +30,39 @@ class ConvertDataSize():
         self.rounding = rounding                    # Round to sector sizes
 
     def _process(self, arg):
+        "Walk the terms of arg once, summing them up"
         arg = arg.strip().upper().replace('B', '')
-        if not arg:
-            return 0
-
-        start = arg[0]
-        end = arg[-1]
-
-        if start == '-':
-            return self.blocksize - self._process(arg[1:])
 
-        if '+' in arg:
-            return sum(map(self._process, arg.split('+')))
-
-        if '-' in arg:
-            args = arg.split('-')
-            val = self._process(args.pop(0))
-            for a in args:
-                val -= self._process(a)
-                return val
-
-        if end in 'KMGTPEZY':
-            return self._process(arg[:-1]) * self.binary_prefix ** (' KMGTPEZY'.index(end))
-
-        if end == '%':
-            if arg.count('%') > 1:
-                raise ValueError("Extra % in arg:", arg)        # pylint: disable=W0715
-            arg = float(arg[:-1])
-            if not 0 <= arg <= 100:
-                print("Percentages must be between 0 and 100, not", str(arg) + '%')
+        # A leading minus means the blocksize minus everything after it, so two cancel out
+        remainder = False
+        while arg.startswith('-'):
+            remainder = not remainder
+            arg = arg[1:].lstrip()
+
+        total = 0
+        parts = _SIGN.split(arg)        # term, sign, term, sign, term...
+        for sign, term in zip(['+'] + parts[1::2], parts[0::2]):
+            term = term.strip()
+            if not term:
+                continue        # Empty terms like the end of "1M-" count as 0
+            match = _TERM.fullmatch(term)
+            if not match:
+                print("Could not understand arg:", arg)
                 return None
+            num, unit = match.groups()
+            num = float(num)
+            if unit == '%':
+                if not 0 <= num <= 100:
+                    print("Percentages must be between 0 and 100, not", str(num) + '%')
+                    return None
+                val = int(num / 100 * self.blocksize)
             else:
-                return int(arg / 100 * self.blocksize)
+                val = num * self.binary_prefix ** _POWERS[unit]
+            total += -val if sign == '-' else val
 
-        if is_num(arg):
-            return float(arg)
-        else:
-            print("Could not understand arg:", arg)
-            return None
+        if remainder:
+            return self.blocksize - total
+        return total
 
     def __call__(self, arg):
         "Pass string to convert"
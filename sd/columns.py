@@ -1,11 +1,55 @@
 #!/usr/bin/python3
 # Manipulate columns of text
+from functools import lru_cache
 from shutil import get_terminal_size
 
 def term_width():
     return max(get_terminal_size().columns, 20)
 
 
+def _tab_len(text):
+    "Length of text with each tab counted as 4 spaces"
+    return len(text) + 3 * text.count('\t')
+
+
+def _wrap_words(words, header, cut):
+    "Greedy wrap of words into lines no longer than cut, 0 = Don't wrap"
+    hlen = _tab_len(header)     # Header length with tabs expanded
+    out = []
+    parts = []                  # Words on the current line
+    length = 0                  # Current line length with tabs expanded
+    for word in words:
+        wlen = _tab_len(word)
+        new = length + 1 + wlen if parts else hlen + wlen
+        if cut and new > cut:
+            out.append(header + ' '.join(parts) if parts else '')
+            parts = [word]
+            length = hlen + wlen
+        else:
+            parts.append(word)
+            length = new
+    line = header + ' '.join(parts) if parts else ''
+    if line:
+        out.append(line)
+    return out
+
+
+def _line_count(wlens, hlen, cut):
+    "Number of lines _wrap_words would return, given the length of each word and the header"
+    lines = 0
+    length = None               # Current line length, None before the first word
+    for wlen in wlens:
+        new = hlen + wlen if length is None else length + 1 + wlen
+        if cut and new > cut:
+            lines += 1
+            length = hlen + wlen
+        else:
+            length = new
+    if length:
+        lines += 1
+    return lines
+
+
 def indenter(*args, header='', level=0, tab=4, wrap=-4, even=False):
     '''
     Break up text into tabbed lines.
@@ -21,31 +65,25 @@ def indenter(*args, header='', level=0, tab=4, wrap=-4, even=False):
     header = str(header) + tab * level
     words = (' '.join(map(str, args))).split(' ')
 
-    lc = float('inf')       # line count
-    for cut in range(wrap, -1, -1):
-        out = []
-        line = ''
-        count = 0
-        for word in words:
-            if count:
-                new = line + ' ' + word
-            else:
-                new = header + word
-            count += 1
-            if cut and len(new.replace('\t', ' ' * 4)) > cut:
-                out.append(line)
-                line = header + word
-            else:
-                line = new
-        if line:
-            out.append(line)
-        if not even:
-            return out
-        if len(out) > lc:
-            return prev
-        prev = out.copy()
-        lc = len(out)
-    return out
+    if not even or wrap <= 0:
+        return _wrap_words(words, header, max(wrap, 0))
+
+    # Binary search for the narrowest cut that needs no more lines than wrap does
+    hlen = _tab_len(header)
+    wlens = [_tab_len(word) for word in words]
+    lc = _line_count(wlens, hlen, wrap)
+    low, high = 1, wrap
+    while low < high:
+        mid = (low + high) // 2
+        if _line_count(wlens, hlen, mid) <= lc:
+            high = mid
+        else:
+            low = mid + 1
+
+    # If every cut fits, the text was short enough to not need wrapping at all
+    if low == 1 and _line_count(wlens, hlen, 0) <= lc:
+        low = 0
+    return _wrap_words(words, header, low)
 
 
 def tab_printer(*args, **kargs):
@@ -68,6 +106,18 @@ def _just2func(just):
         raise ValueError("Cannot understand justification:", just)
 
 
+@lru_cache(maxsize=64)
+def _row_format(columns, just):
+    "Format string for a row of left or right justified columns, None for center"
+    op = _just2func(just)
+    if op is str.center:
+        # str.center places odd padding differently than the ^ format spec
+        return None
+    align = '<' if op is str.ljust else '>'
+    # ljust and rjust treat a negative width as 0, but a format spec refuses the sign
+    return ''.join('{:' + align + str(max(width, 0)) + '}' for width in columns)
+
+
 def print_columns(args, col_width=20, columns=None, just='left', space=0, wrap=True):
     '''Print columns of col_width size.
     columns = manual list of column widths
@@ -75,8 +125,15 @@ def print_columns(args, col_width=20, columns=None, just='left', space=0, wrap=T
 
     if not columns:
         columns = [col_width] * len(args)
+    columns = tuple(columns[:len(args)])
+    fmt = _row_format(columns, just)
 
-    output = ""
+    def render(row):
+        if fmt:
+            return fmt.format(*row)
+        return ''.join(str.center(section, width) for section, width in zip(row, columns))
+
+    sections = []
     extra = []
     for count, section in enumerate(args):
         width = columns[count]
@@ -98,11 +155,10 @@ def print_columns(args, col_width=20, columns=None, just='left', space=0, wrap=T
                         extra.append([''] * len(args))
                     extra[lineno][count] = line
 
-        output += _just2func(just)(section, width)
-    print(output)
+        sections.append(section)
 
-    for line in extra:
-        print_columns(line, col_width, columns, just, space, wrap=False)
+    # Print the row and any wrapped lines below it all at once
+    print('\n'.join([render(sections)] + [render(line) for line in extra]))
 
 print_cols = print_columns  # pylint: disable=C0103
 
@@ -123,39 +179,35 @@ def expand_newlines(line):
 
 def crop_columns(array, crop):
     "Given a 2d array, crop any cell which exceeds the crop value and append ..."
-    out = []
-    for row in array:
-        line = []
-        for index, item in enumerate(row):
-            cut = crop.get(index, 0)
-            length = len(item)
-            if length > cut > 3:
-                line.append(item[:cut-3]+'...')
-            elif cut > 0:
-                line.append(item[:cut])
-            else:
-                line.append(item)
-        out.append(line)
-    return out
+    # Look up the crop for each column once instead of for every cell
+    cuts = [crop.get(index, 0) for index in range(max(map(len, array), default=0))]
+    return [[item[:cut-3] + '...' if len(item) > cut > 3 else item[:cut] if cut > 0 else item
+             for item, cut in zip(row, cuts)] for row in array]
 
 
 def _fit_in_width(col_width, max_width):
     "Adjust array of column widths to fit inside a maximum"
-    extra = sum(col_width) - max_width          # Amount columns exceed the terminal width
+    # Find the total, largest column and its index in a single pass
+    total = 0
+    biggest = -1
+    index = 0
+    for x, width in enumerate(col_width):
+        total += width
+        if width > biggest:
+            biggest = width
+            index = x
+    extra = total - max_width                   # Amount columns exceed the terminal width
 
     def fill_remainder():
         "After operation to reduce column sizes, use up any remaining space"
         remain = max_width - sum(col_width)
-        for x, _ in enumerate(col_width):
-            if remain:
-                col_width[x] += 1
-                remain -= 1
+        for x in range(min(remain, len(col_width))):
+            col_width[x] += 1
 
     # Reduce column widths to fit in terminal
     if extra > 0:
-        if max(col_width) > 0.5 * sum(col_width):
+        if biggest > 0.5 * total:
             # If there's one large column, reduce it
-            index = col_width.index(max(col_width))
             col_width[index] -= extra
             if col_width[index] < max_width // len(col_width):
                 # However if that's not enough reduce all columns equally
@@ -169,6 +221,21 @@ def _fit_in_width(col_width, max_width):
     return col_width
 
 
+@lru_cache(maxsize=64)
+def _layout(col_width, space, manual, max_width):
+    "Final column widths for auto_columns, cached for tables that are redrawn with the same shape"
+    spaces = [space] * len(col_width)
+    if spaces:
+        spaces[-1] = 0
+
+    # Make any manual adjustments
+    for col, val in manual:
+        spaces[col] = val
+
+    col_width = [sum(x) for x in zip(col_width, spaces)]
+    return tuple(_fit_in_width(col_width, max_width))
+
+
 def auto_columns(array, space=4, manual=None, printme=True, wrap=0, crop=None, just='left'):
     '''Automatically adjust column size
     Takes in a 2d array and prints it neatly
@@ -194,24 +261,15 @@ def auto_columns(array, space=4, manual=None, printme=True, wrap=0, crop=None, j
 
 
     # Fixed so array can have inconsistently sized rows
-    col_width = {}
+    col_width = []
     for row in array:
-        row = list(map(str, row))
-        for col, _ in enumerate(row):
-            length = len(row[col])
-            if col not in col_width or length > col_width[col]:
+        lengths = [len(item) if isinstance(item, str) else len(str(item)) for item in row]
+        for col, length in enumerate(lengths[:len(col_width)]):
+            if length > col_width[col]:
                 col_width[col] = length
+        col_width.extend(lengths[len(col_width):])
 
-    col_width = [col_width[key] for key in sorted(col_width.keys())]
-    spaces = [space] * len(col_width)
-    if spaces:
-        spaces[-1] = 0
-
-    # Make any manual adjustments
-    for col, val in manual.items():
-        spaces[col] = val
-
-    col_width = [sum(x) for x in zip(col_width, spaces)]
+    col_width = tuple(col_width)
 
     # Adjust for line wrap and fit in terminal
     max_width = term_width() - 1 # Terminal size
@@ -219,7 +277,7 @@ def auto_columns(array, space=4, manual=None, printme=True, wrap=0, crop=None, j
         wrap = max_width + wrap
     if wrap:
         max_width = min(max_width, wrap)
-    col_width = _fit_in_width(col_width, max_width)
+    col_width = _layout(col_width, space, tuple(manual.items()), max_width)
 
     '''
     # Turn on for visual representation of columns:
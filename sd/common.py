@@ -2,15 +2,15 @@
 # An autogenerated selection of SurpriseDog's common functions relevant to this project.
 # To see how this file was created visit: https://github.com/SurpriseDog/Star-Wrangler
 
+import bisect
+
+
 def bisect_small(lis, num):
-    '''Given a sorted list, returns the index of the biggest number <= than num
+    '''Given a sorted list, returns the index of the biggest number < than num
     Unlike bisect will never return an index which doesn't exist'''
-    end = len(lis) - 1
-    for x in range(end + 1):
-        if lis[x] >= num:
-            return max(x - 1, 0)
-    else:
-        return end
+    if not lis:
+        return -1
+    return max(bisect.bisect_left(lis, num) - 1, 0)
 
 
 def undent(text, tab=''):
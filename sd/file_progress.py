@@ -1,44 +1,129 @@
 #!/usr/bin/python3
 
 import os
+import sys
 import math
 import time
+import bisect
 import random
+import collections
 import shutil
+import signal
+import itertools
 import unicodedata
 from sd.format_number import rfs, fmt_time
 
+
+# Terminal width of each character seen so far, printable ascii is prefilled
+_WIDTH_CACHE = {chr(num): 1 for num in range(32, 127)}
+
+
+def _compute_width(c):
+    "Number of terminal columns taken by a single character"
+    # Special thanks to this answer https://stackoverflow.com/q/48598304/11343425
+    if unicodedata.category(c)[0] in ('M', 'C'):
+        return 0
+    if unicodedata.east_asian_width(c) in ('N', 'Na', 'H', 'A'):
+        return 1
+    return 2
+
+
+def char_width(c):
+    "Cached version of _compute_width"
+    wide = _WIDTH_CACHE.get(c)
+    if wide is None:
+        wide = _compute_width(c)
+        _WIDTH_CACHE[c] = wide
+    return wide
+
+
+# Time the terminal width was last checked and the width
+_TERM_CACHE = [0.0, 80]
+_WINCH = [False]            # Has term_width tried to install its SIGWINCH handler?
+
+
+def _watch_resize():
+    '''Recheck the width right away if the terminal is resized
+    Only if the program hasn't set its own handler, otherwise the ttl alone is used'''
+    _WINCH[0] = True
+    if not hasattr(signal, 'SIGWINCH'):
+        return
+    try:
+        if signal.getsignal(signal.SIGWINCH) == signal.SIG_DFL:
+            signal.signal(signal.SIGWINCH, lambda *_: _TERM_CACHE.__setitem__(0, 0.0))
+    except ValueError:
+        pass            # Only the main thread can set signal handlers
+
+
+def term_width(ttl=1.0):
+    "shutil.get_terminal_size()[0] rechecked at most every ttl seconds"
+    if not _WINCH[0]:
+        _watch_resize()
+    now = time.monotonic()
+    if now - _TERM_CACHE[0] > ttl:
+        _TERM_CACHE[:] = [now, shutil.get_terminal_size()[0]]      # 2.5 microseconds
+    return _TERM_CACHE[1]
+
+
+# Arguments of the last tprint call, to skip redrawing an unchanged line
+_LAST_TPRINT = [None]
+
+
+def tprint_reset():
+    "Call after printing something else, so the next tprint draws even if its text is the same"
+    _LAST_TPRINT[0] = None
+
+
 def tprint(*args, ending='...', **kargs):
-    "Terminal print: Erasable text in terminal"
-    length = shutil.get_terminal_size()[0]      # 2.5 microseconds
+    '''Terminal print: Erasable text in terminal
+    Repeated calls with the same text are skipped, until tprint_reset() is called'''
+    length = term_width()
     text = ' '.join(map(str, args))
-    # Sum up the width of each character in the text
-    # Special thanks to this answer https://stackoverflow.com/q/48598304/11343425
-    # Measured at 20 microseconds on slow hardware excluding print statement
-    widths = []             # Widths of each character in the text
-    total = 0               # Total width seen thus fur
-    for c in text:
-        if 32 <= ord(c) <= 126:
-            wide = 1
-        elif unicodedata.category(c)[0] in ('M', 'C'):
-            wide = 0
-        elif unicodedata.east_asian_width(c) in ('N', 'Na', 'H', 'A'):
-            wide = 1
-        else:
-            wide = 2
-        widths.append(wide)
-        total += wide
+    key = (text, ending, length, kargs)
+    if key == _LAST_TPRINT[0]:
+        return
+    # Text with a newline leaves a line behind that can't be erased, so never skip it
+    _LAST_TPRINT[0] = None if '\n' in text else key
 
-        # If total exceeds length, delete chars at end one by one until the ending ... can be fit in
+    cut = None              # Number of chars kept if the text must be truncated
+
+    # Printable ascii is always one column wide, so skip the per character loop
+    if text.isascii() and text.isprintable():
+        total = len(text)
         if total > length:
             length -= len(ending)
-            while total > length and widths:
-                total -= widths.pop(-1)
-            text = text[:len(widths)] + ending
-            break
+            cut = total = length
+    else:
+        # Sum up the width of each character in the text
+        # Measured at 20 microseconds on slow hardware excluding print statement
+        widths = []             # Widths of each character in the text
+        total = 0               # Total width seen thus fur
+        get = _WIDTH_CACHE.get
+        for c in text:
+            wide = get(c)
+            if wide is None:
+                wide = char_width(c)
+            widths.append(wide)
+            total += wide
+
+            # If total exceeds length, binary search for the last char that leaves room for the ending ...
+            if total > length:
+                length -= len(ending)
+                cum = list(itertools.accumulate(widths))
+                cut = bisect.bisect_right(cum, length)
+                total = cum[cut - 1] if cut else 0
+                break
 
     # Filling out the end of the line with spaces ensures that if something else prints it will not be mangled
-    print('\r' + text + ' ' * (length - total), **kargs, end='')
+    if cut is None:
+        line = f"\r{text}{' ' * (length - total)}"
+    else:
+        line = f"\r{text[:cut]}{ending}{' ' * (length - total)}"
+    # Write directly, print() would make a second write call for its empty end
+    file = kargs.get('file') or sys.stdout
+    file.write(line)
+    if kargs.get('flush'):
+        file.flush()
 
     # Test wth the toxic megacolons:  tprint('：'*222)
 
@@ -60,7 +145,7 @@ class FileProgress:
 
         self.rate = 0                   # Average data rate
         self.eta = 0                    # Average eta based on history
-        self.history = []               # array with expected eta
+        self.history = collections.deque(maxlen=10)     # Last 10 (time, eta) pairs
 
         self.data_seen = 0              # Data Processed
         self.data_total = data_total    # Total expected data size
@@ -117,8 +202,6 @@ class FileProgress:
                 eta = now + (self.data_total - self.data_seen) / self.rate
                 self.history.append((now, eta))
                 self.eta = eta
-            while len(self.history) > 10 and now - last > 10:
-                self.history.pop(0)
             self.eta = self.calc_eta()
 
 
@@ -156,7 +239,7 @@ class FileProgress:
                     continue
 
                 # Weighted average with more recent etas counting more
-                weight = 10 / math.log(age + 2, 2)      # 220 ns
+                weight = 10 / math.log2(age + 2)
                 total += left * weight
                 weights += weight
                 if verbose:
@@ -193,24 +276,25 @@ class FileProgress:
             start_delay = Wait a bit before displaying text to ensure accuracy
         '''
         now = time.perf_counter()
-        txt = {"processing" : str(self.count) + ' of ' + str(self.total)}
-        default = "#" + txt['processing']
+        processing = f"{self.count} of {self.total}"
+        txt = {"processing" : processing}
+        default = "#" + processing
 
         if self.eta and now - self.start > start_delay:
             if self.rt_rate:
-                txt['realtime'] = bps(self.rt_rate)
-                default += ' at ' + txt['realtime']
+                realtime = txt['realtime'] = bps(self.rt_rate)
+                default += f" at {realtime}"
 
-            txt['average'] = bps(self.rate)
+            average = txt['average'] = bps(self.rate)
             remain = self.eta - now
             remain = 0 if remain < 0 else remain
             if remain >= 10:
-                txt['remaining'] = fmt_time(remain)
+                # Only whole seconds are shown, so rounding down lets fmt_time reuse its cache
+                remaining = fmt_time(int(remain))
             else:
-                txt['remaining'] = str(round(remain, 1)) + ' seconds'
-            default += ' averaging ' + txt['average'] + \
-                       ' with ' + txt['remaining'] + ' remaining'
-                       # +  str(len(self.history))
+                remaining = f"{round(remain, 1)} seconds"
+            txt['remaining'] = remaining
+            default += f" averaging {average} with {remaining} remaining"
         txt['default'] = default
         return txt
 
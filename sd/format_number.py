@@ -1,10 +1,32 @@
 #!/usr/bin/python3
 # Format numbers for easy reading
 
+import bisect
 import datetime
+from functools import lru_cache
 from sd.common import bisect_small
 
 INF = float("inf")
+_G_FMT = {d: '{0:.' + str(d) + 'g}' for d in range(1, 10)}      # Format strings used by sig
+_MAGNITUDES = {}        # (mult, levels) : tuple of mult**x used by rfs
+
+# Time units used by fmt_time. For calculations involving leap years, use the datetime library:
+_LIMITS = (5.391e-44, 1e-24, 1e-21, 1e-18, 1e-15, 1e-12, 1e-09, 1e-06, 0.001, 1, 60,
+           3600, 3600 * 24, 3600 * 24 * 7, 3600 * 24 * 30.4167, 3600 * 24 * 365.2422)
+_NAMES = ('Planck time', 'yoctosecond', 'zeptosecond', 'attosecond', 'femtosecond', 'picosecond',
+          'nanosecond', 'microsecond', 'millisecond', 'second', 'minute', 'hour', 'day', 'week',
+          'month', 'year')
+# (seconds, name, plural name) for each unit
+_UNITS = tuple((limit, name, name + 's') for limit, name in zip(_LIMITS, _NAMES))
+
+
+def _magnitudes(mult, levels):
+    "Powers of mult for each level of rfs, computed once per mult"
+    key = (mult, levels)
+    mags = _MAGNITUDES.get(key)
+    if mags is None:
+        mags = _MAGNITUDES[key] = tuple(mult**x for x in range(levels))
+    return mags
 
 
 def percent(num, digits=0):
@@ -14,6 +36,7 @@ def percent(num, digits=0):
         return sig(num * 100, digits) + '%'
 
 
+@lru_cache(maxsize=2048)
 def rfs(num, mult=1000, digits=3, order=' KMGTPEZYB', suffix='B', space=' ', fixed=None):
     '''A "readable" file size
     mult is the value of a kilobyte in the filesystem. (1000 or 1024)
@@ -21,6 +44,7 @@ def rfs(num, mult=1000, digits=3, order=' KMGTPEZYB', suffix='B', space=' ', fix
     fixed is the number of digits to force display ex: '5.000 MB'
     suffix is a trailing character (B for Bytes)
     space is the space between '3.14 M' for 3.14 Megabytes
+    Results are cached, so order must be a string or tuple
     '''
     if abs(num) < mult:
         return sig(num) + space + suffix
@@ -39,20 +63,19 @@ def rfs(num, mult=1000, digits=3, order=' KMGTPEZYB', suffix='B', space=' ', fix
                       "combined contains around a BrontoByte of data storage")
 
     # Faster than using math.log:
-    for x in range(len(order) - 1, -1, -1):
-        magnitude = mult**x
-        if abs(num) >= magnitude:
-            if fixed:
-                num = ('{0:.' + str(fixed) + 'f}').format(num / magnitude)
-            else:
-                num = sig(num / magnitude, digits)
-            return num + space + (order[x] + suffix).rstrip()
-    return str(num) + suffix        # Never called, but needed for pylint
+    mags = _magnitudes(mult, len(order))
+    x = bisect.bisect_right(mags, abs(num)) - 1
+    magnitude = mags[x]
+    if fixed:
+        num = ('{0:.' + str(fixed) + 'f}').format(num / magnitude)
+    else:
+        num = sig(num / magnitude, digits)
+    return num + space + (order[x] + suffix).rstrip()
 
 
 def mrfs(*args):
     "rfs for memory sizes"
-    return rfs(*args, mult=1024, order=[' ', 'Ki', 'Mi', 'Gi', 'Ti', 'Pi', 'Ei', 'Zi', 'Yi', 'Bi'])
+    return rfs(*args, mult=1024, order=(' ', 'Ki', 'Mi', 'Gi', 'Ti', 'Pi', 'Ei', 'Zi', 'Yi', 'Bi'))
 
 
 def rns(num):
@@ -83,6 +106,7 @@ def fmt_clock(num, smallest=None):
         return s
 
 
+@lru_cache(maxsize=1024)
 def fmt_time(num, digits=2, pretty=True, smallest=None, fields=None, zeroes='skip', **kargs):
     '''Return a neatly formated time string.
     sig         = the number of significant digits.
@@ -93,7 +117,7 @@ def fmt_time(num, digits=2, pretty=True, smallest=None, fields=None, zeroes='ski
     '''
     if num < 0:
         num *= -1
-        return '-' + fmt_time(**locals())
+        return '-' + fmt_time(num, digits, pretty, smallest, fields, zeroes, **kargs)
     if not pretty:
         return fmt_clock(num, smallest)
 
@@ -109,33 +133,9 @@ def fmt_time(num, digits=2, pretty=True, smallest=None, fields=None, zeroes='ski
     if num < 5.391e-44:
         return "0 seconds"
     out = []
-    # For calculations involving leap years, use the datetime library:
-    limits = (5.391e-44, 1e-24, 1e-21, 1e-18, 1e-15, 1e-12, 1e-09, 1e-06, 0.001, 1, 60,
-              3600, 3600 * 24, 3600 * 24 * 7, 3600 * 24 * 30.4167, 3600 * 24 * 365.2422)
-    names = (
-        'Planck time',
-        'yoctosecond',
-        'zeptosecond',
-        'attosecond',
-        'femtosecond',
-        'picosecond',
-        'nanosecond',
-        'microsecond',
-        'millisecond',
-        'second',
-        'minute',
-        'hour',
-        'day',
-        'week',
-        'month',
-        'year')
-
-    index = bisect_small(limits, num) + 1
-    while index > 0:
-        index -= 1
-        unit = limits[index]        #
+    index = bisect_small(_LIMITS, num)
+    for unit, name, plural in _UNITS[index::-1]:
         u_num = num / unit          # unit number for current name
-        name = names[index]         # Unit name like weeks
 
         if name == 'week' and u_num < 2:
             # Replace weeks with days when less than 2 weeks
@@ -148,7 +148,7 @@ def fmt_time(num, digits=2, pretty=True, smallest=None, fields=None, zeroes='ski
             u_num = int(u_num)
             if u_num == 0 and zeroes == 'skip':
                 continue
-            out += [str(u_num) + ' ' + name + ('s' if u_num != 1 else '')]
+            out.append(f"{u_num} {plural if u_num != 1 else name}")
             num -= u_num * unit
             if fr == 0:
                 break
@@ -169,13 +169,13 @@ def fmt_time(num, digits=2, pretty=True, smallest=None, fields=None, zeroes='ski
 
         if num >= 60:     # Minutes or higher
             u_num = int(u_num)
-            out += [str(u_num) + ' ' + name + ('s' if u_num != 1 else '')]
+            out.append(f"{u_num} {plural if u_num != 1 else name}")
             digits -= len(str(u_num))
             num -= u_num * unit
         else:
             # If time is less than a minute, just output last field and quit
             d = digits if digits >= 1 else 1
-            out += [sig(u_num, d) + ' ' + name + ('s' if u_num != 1 else '')]
+            out.append(f"{sig(u_num, d)} {plural if u_num != 1 else name}")
             break
 
     return ', '.join(out)
@@ -207,6 +207,13 @@ def sig(num, digits=3):
 '''
 
 
+def _strip_zeroes(out):
+    "Remove trailing zeroes after the decimal point: 1.50 -> 1.5, 2.0 -> 2, but 20 stays 20"
+    if '.' in out:
+        return out.rstrip('0').rstrip('.')
+    return out
+
+
 def sig(num, digits=3, trailing=False):
     # post to https://stackoverflow.com/questions/658763/how-to-suppress-scientific-notation-when-printing-float-values
     '''Return number formatted for significant digits
@@ -219,6 +226,11 @@ def sig(num, digits=3, trailing=False):
         return '0'
     if num == INF:
         return 'inf'
+    fmt = _G_FMT.get(digits) or '{0:.' + str(digits) + 'g}'
+
+    # Common case: Too few whole digits to print as an integer, but big enough that g won't use an exponent
+    if 1 <= abs(num) < 10 ** (digits - 1):
+        return fmt.format(num)
 
     # Return as integer if it meets the digits req
     out = str(int(num))
@@ -226,16 +238,16 @@ def sig(num, digits=3, trailing=False):
         return out
 
     # Use the g method if possible, but fails for small numbers
-    out = ('{0:.' + str(digits) + 'g}').format(num)
+    out = fmt.format(num)
     if 'e' not in out:
-        return out.rstrip('0.') if not trailing else out
+        return _strip_zeroes(out) if not trailing else out
 
     # Otherwise try to fromat as float using the correct precision
     # Text processing is the only way to get this to work correctly without
     # rounding errors of the other methods like math.log
     power = int(out.split('e-')[-1])
     out = ('{0:.' + str(power + digits - 1) + 'f}').format(num)
-    return out.rstrip('0.') if not trailing else out
+    return _strip_zeroes(out) if not trailing else out
 
 
 def _test_sig():
@@ -23,15 +23,20 @@ def rotate(path, limit=5, prefix='.', move=True, verbose=False):
     if move:
 
         # Go thru file list looking for the first missing file
+        # One listing of the folder replaces a stat for each file in the sequence
+        existing = set(os.listdir(os.path.dirname(files[0]) or '.'))
         gap = 0         # Position of first missing file
         for gap, name in enumerate(files):
-            if not os.path.exists(name):
+            if os.path.basename(name) not in existing:
                 break
         else:
             dest = files[-1]
             if verbose:
                 print("Removing:", dest)
-            os.remove(dest)
+            try:
+                os.remove(dest)
+            except FileNotFoundError:
+                pass
 
         # Go thru file list backwards, moving each one
         dest = files[gap]
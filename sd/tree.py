@@ -5,6 +5,8 @@
 import os
 import sys
 import mimetypes
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from sd.format_number import rfs
 
@@ -92,16 +94,21 @@ def dirtime(folder='.', deep=-1, verbose=False):
     deep        # Recursion level, -1 = infinite, 0 = Don't recurse
     '''
     mtime = 0
-    for entry in os.scandir(folder):
-        if verbose:
-            print(entry.path)
-        if entry.is_symlink():
-            continue
-        if entry.is_dir() and (deep != 0):
-            mtime = max(mtime, dirtime(entry.path, deep-1))
-        else:
-            stat = entry.stat(follow_symlinks=False)
-            mtime = max(mtime, stat.st_mtime)
+    stack = [(folder, deep)]        # Folders left to check and their recursion level
+    while stack:
+        folder, deep = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if verbose:
+                    print(entry.path)
+                if entry.is_symlink():
+                    continue
+                if entry.is_dir() and (deep != 0):
+                    stack.append((entry.path, deep - 1))
+                else:
+                    newest = entry.stat(follow_symlinks=False).st_mtime
+                    if newest > mtime:
+                        mtime = newest
     return mtime
 
 
@@ -128,6 +135,17 @@ def walker(dirname, verbose=False):
 
 
 
+def list_folder(dirname):
+    "Return a list of the entries in a folder"
+    with os.scandir(dirname) as entries:
+        return list(entries)
+
+
+def lstat(entry):
+    "Stat a DirEntry without following symlinks"
+    return entry.stat(follow_symlinks=False)
+
+
 def walk_folders(dirname, delete_empty=False):
     '''Walk through all folders, while yielding each one
     delete_empty will delete empty folders recursively
@@ -190,6 +208,7 @@ class Tree:
         # print('kargs', kargs)
         # print('uargs', uargs)
         self.uargs = uargs
+        self.mime_cache = {}        # Last two extensions : skipped mime type or ''
 
 
     def reset(self,):
@@ -198,10 +217,11 @@ class Tree:
         self.size = 0
 
 
-    def scan(self, dirname=None, verbose=False):
-        "Scan the file tree and return the count and total size."
+    def scan(self, dirname=None, verbose=False, threads=1):
+        '''Scan the file tree and return the count and total size.
+        threads = List folders and stat files ahead in this many threads'''
         self.reset()
-        for _ in self.walk(dirname):
+        for _ in self.walk(dirname, threads=threads):
             pass
         if verbose:
             print("\nScanned", self.count, 'files spanning', rfs(self.size))
@@ -209,91 +229,183 @@ class Tree:
         return self.count, self.size
 
 
+    def sprint(self, text, pathname):
+        "Print the reason a path was skipped if requested"
+        if self.uargs['print_skips']:
+            print(text.ljust(20), pathname)
+
+
     def skip(self, entry, pathname):
         "Given an entry and pathname, should it be skipped?"
         name = entry.name
+        uargs = self.uargs              # Called for every file, so avoid the attribute lookups
 
-        def sprint(text):
-            if self.uargs['print_skips']:
-                print(text.ljust(20), pathname)
+        # Cheapest checks first
+        if uargs['skip_syms'] and entry.is_symlink():
+            self.sprint('Skipping symlink:', pathname)
+            return True
 
-        if self.uargs['skip_exts']:
-            if os.path.splitext(name)[-1] in self.uargs['skip_exts']:
+        if uargs['skip_exts']:
+            if os.path.splitext(name)[-1] in uargs['skip_exts']:
                 return True
 
-        if self.uargs['skip_mimes']:
-            mime = mimetypes.guess_type(name)[0]
-            if mime and [m for m in self.uargs['skip_mimes'] if m in mime]:
-                sprint('Skipping bad mime: ' + str(mime))
+        if uargs['skip_mimes']:
+            # guess_type only looks at the extension and a compression extension before it
+            base, ext = os.path.splitext(name)
+            key = os.path.splitext(base)[1] + ext
+            bad = self.mime_cache.get(key)
+            if bad is None:
+                mime = mimetypes.guess_type(name)[0]
+                bad = mime if mime and [m for m in uargs['skip_mimes'] if m in mime] else ''
+                self.mime_cache[key] = bad
+            if bad:
+                self.sprint('Skipping bad mime: ' + bad, pathname)
                 return True
 
-        if self.uargs['skip_hidden']:
+        if uargs['skip_hidden']:
             if name[-1] == '~' or name[0] == '.':
-                sprint('Skipping hidden:')
+                self.sprint('Skipping hidden:', pathname)
                 return True
 
-        if self.uargs['skip_cache']:
+        if uargs['skip_cache']:
             if 'cache' in name.lower():
-                sprint('Skipping cache:')
+                self.sprint('Skipping cache:', pathname)
                 return True
 
-        if self.uargs['skip_syms'] and entry.is_symlink():
-            sprint('Skipping symlink:')
-            return True
-
-        if self.uargs['skip_paths']:
-            for spath in self.uargs['skip_paths']:
-                if pathname == spath:
-                    sprint('Skipping path:')
-                    return True
-
-        # print(entry.name, entry.is_symlink(), self.uargs['skip_syms'])
-        if entry.is_dir():
-            if self.uargs['skip_dirs']:
-                lower = name.lower()
-                for expr in self.uargs['skip_dirs']:
-                    if expr in lower:
-                        sprint('Skipping dir:')
-                        return True
-            if not os.access(pathname, os.R_OK):
-                sprint("Can't access:")
+        if uargs['skip_paths']:
+            if pathname in uargs['skip_paths']:
+                self.sprint('Skipping path:', pathname)
                 return True
 
+        if uargs['skip_dirs'] and entry.is_dir():
+            lower = name.lower()
+            for expr in uargs['skip_dirs']:
+                if expr in lower:
+                    self.sprint('Skipping dir:', pathname)
+                    return True
 
         return False
 
 
-    def walk(self, dirname=None, yield_stat=False):
+    def walk(self, dirname=None, yield_stat=False, threads=1):
         '''Walk through the file tree yielding filenames if conditions are met.
         yield_stat = yield files, stat information
+        threads = List folders and stat files ahead in this many threads (helps network filesystems)
         '''
         if not dirname:
             dirname = self.root
-        for entry in os.scandir(dirname):
-            name = entry.name
-            pathname = os.path.join(dirname, name)
+        if threads > 1:
+            with ThreadPoolExecutor(threads) as pool:
+                yield from self._walk(dirname, yield_stat, pool, threads)
+        else:
+            yield from self._walk(dirname, yield_stat)
+
+
+    def _queue(self, dirname, entries):
+        '''Decide what to skip in a folder
+        Returns a list of [is_dir, pathname, absolute path, system call argument, future]'''
+        # Join paths by concatenating onto prefixes made once per folder
+        prefix = os.path.join(dirname, '')
+        absprefix = os.path.join(os.path.abspath(dirname), '')
+        todo = []
+        for entry in entries:
+            pathname = prefix + entry.name
             if self.skip(entry, pathname):
                 continue
-
             if entry.is_dir():
-                yield from self.walk(pathname, yield_stat)
+                todo.append([True, pathname, None, pathname, None])
             else:
+                todo.append([False, pathname, absprefix + entry.name, entry, None])
+        return todo
+
+
+    def _walk(self, dirname, yield_stat, pool=None, threads=1):
+        '''Part of walk, using pool to run the system calls ahead of time
+        Keeps a stack of the folders being walked instead of recursing'''
+        # At most 2 * threads calls are queued, so a huge folder doesn't become a huge list of futures
+        limit = 2 * threads if pool else 0
+        pending = dict()                    # Queued futures: their item in a folder
+
+        def fetch(folder):
+            "Return the next item in a folder and its result, queueing the calls after it"
+            todo, pos = folder
+            folder[1] += 1
+            index = pos
+            while len(pending) < limit and index < len(todo):
+                item = todo[index]
+                if not item[4]:
+                    item[4] = pool.submit(list_folder if item[0] else lstat, item[3])
+                    pending[item[4]] = item
+                index += 1
+
+            item = todo[pos]
+            future = item[4]
+            if future:
+                del pending[future]
+                return item, future.result
+            return item, partial(list_folder if item[0] else lstat, item[3])
+
+        def rewind():
+            "Take back the calls that haven't started, so the subfolder gets the threads first"
+            for future, item in list(pending.items()):
+                if future.cancel():
+                    item[4] = None
+                    del pending[future]
+
+        # Read the options once instead of for every file
+        uargs = self.uargs
+        min_t, max_t = uargs['min_t'], uargs['max_t']
+        min_size, max_size = uargs['min_size'], uargs['max_size']
+        print_files = uargs['print_files']
+        rootprefix = os.path.join(self.root, '')        # Sliced off pathnames for print_files
+
+        # Unreadable folders are found by listing them, instead of an extra access() call
+        # Anything that vanishes or changes type mid scan is skipped the same way
+        try:
+            entries = list_folder(dirname)
+        except OSError:
+            self.sprint("Can't access:", dirname)
+            return
+        stack = [[self._queue(dirname, entries), 0]]       # Folders being walked: [items, position]
+        try:
+            while stack:
+                folder = stack[-1]
+                if folder[1] >= len(folder[0]):
+                    stack.pop()
+                    continue
+                (is_dir, pathname, path, _, _), result = fetch(folder)
+                try:
+                    result = result()
+                except OSError:
+                    self.sprint("Can't access:", pathname)
+                    continue
+
+                if is_dir:
+                    # Finish the subfolder before the rest of this one
+                    rewind()
+                    stack.append([self._queue(pathname, result), 0])
+                    continue
+
                 # Process only files in bounds
-                stat = entry.stat(follow_symlinks=False)
-                if self.uargs['min_t'] <= stat.st_mtime <= self.uargs['max_t'] and \
-                   self.uargs['min_size'] <= stat.st_size <= self.uargs['max_size']:
-                    path = os.path.abspath(pathname)
+                stat = result
+                if min_t <= stat.st_mtime <= max_t and min_size <= stat.st_size <= max_size:
                     size = stat.st_size
-                    if self.uargs['print_files']:
-                        print(rfs(size).ljust(11),
-                              os.path.relpath(pathname, start=self.root),
-                             )
+                    if print_files:
+                        if pathname.startswith(rootprefix):
+                            relpath = pathname[len(rootprefix):]
+                        else:
+                            relpath = os.path.relpath(pathname, start=self.root)
+                        print(rfs(size).ljust(11), relpath)
                     self.size += size
                     self.count += 1
                     if yield_stat:
                         yield path, stat
                     else:
                         yield path
+        finally:
+            # On an early exit only wait for the calls already running
+            for future in pending:
+                future.cancel()
 
 
 
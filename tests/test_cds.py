@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+# Run from the repo folder with: python3 -m unittest
+
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from sd.cds import ConvertDataSize
+
+
+class TestConvertDataSize(unittest.TestCase):
+
+    def setUp(self):
+        self.cds = ConvertDataSize(blocksize=1e12)
+
+    def check(self, cases):
+        for arg, expected in cases:
+            with self.subTest(arg=arg), redirect_stdout(StringIO()):
+                self.assertEqual(self.cds(arg), expected)
+
+    def test_sizes(self):
+        self.check([('', 0),
+                    ('1M', 10**6),
+                    ('5KB', 5000),
+                    ('.5K', 500),
+                    (' 1.5 G ', 15 * 10**8),
+                    ('10G-1M', 9999 * 10**6),
+                    ('1M-2K+3', 998003),
+                    ('80%+10G -1M', 809999 * 10**6),
+                   ])
+
+    def test_signs(self):
+        "Same results as the old recursive parser"
+        self.check([('+1M', 10**6),
+                    ('1M-', 10**6),         # Trailing signs add an empty term
+                    ('1M+', 10**6),
+                    ('1M++2M', 3 * 10**6),
+                    ('10M-+1M', 11 * 10**6),
+                    ('-', 10**12),          # Leading minus is the blocksize minus the rest
+                    ('-10%', 9 * 10**11),
+                    ('--1M', 10**6),        # Two leading minuses cancel out
+                    ('---1M', 10**12 - 10**6),
+                   ])
+
+    def test_sign_grammar(self):
+        "Doubled signs mid way are read as an empty term, and every term is subtracted"
+        self.check([('10M--1M', 9 * 10**6),
+                    ('10M+-1M', 9 * 10**6),
+                    ('10M-1M-1M', 8 * 10**6),
+                   ])
+
+    def test_bad_args(self):
+        self.check([('abc', None),
+                    ('1M 2M', None),
+                    ('50%%', None),
+                    ('101%', None),
+                   ])
+
+
+if __name__ == "__main__":
+    unittest.main()
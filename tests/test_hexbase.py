@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# Run from the repo folder with: python3 -m unittest
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+from contextlib import redirect_stdout
+from io import StringIO
+
+import hexbase
+from info import Info
+from database import Database
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StrictOrjson:
+    "Acts like orjson for filenames that aren't utf-8, which it refuses"
+
+    class JSONDecodeError(ValueError):
+        pass
+
+    @staticmethod
+    def dumps(obj):
+        text = json.dumps(obj, ensure_ascii=False)
+        try:
+            return text.encode()
+        except UnicodeEncodeError:
+            raise TypeError("str is not valid UTF-8: surrogates not allowed") from None
+
+    @classmethod
+    def loads(cls, data):
+        obj = json.loads(data)
+        try:
+            json.dumps(obj, ensure_ascii=False).encode()
+        except UnicodeEncodeError:
+            raise cls.JSONDecodeError("unexpected end of data") from None
+        return obj
+
+
+class TestSurrogates(unittest.TestCase):
+    "Filenames that aren't utf-8 are decoded with surrogateescape and must survive a save"
+
+    name = os.fsdecode(b'caf\xe9.bin')
+
+    def test_round_trip(self):
+        obj = [{'pathname': self.name}, None]
+        for module in (None, StrictOrjson, hexbase.orjson):
+            with self.subTest(orjson=module), mock.patch.object(hexbase, 'orjson', module):
+                self.assertEqual(hexbase.loads(hexbase.dumps(obj)), obj)
+
+    def test_journal(self):
+        "A file checkpointed to the journal comes back under the same name"
+        with tempfile.TemporaryDirectory() as target, \
+             mock.patch.object(hexbase, 'orjson', StrictOrjson):
+            path = os.path.join(target, self.name)
+            with open(path, 'wb') as f:
+                f.write(b'data')
+            with redirect_stdout(StringIO()):
+                db = Database(target, target)
+            info = Info(self.name, base=target)
+            info.hash = db.get_hash(info.fullpath)
+            db.files[self.name] = info
+            db.update(info)
+            db.dirty.add(self.name)
+            db.checkpoint()
+
+            with redirect_stdout(StringIO()):
+                files = Database(target, target).files
+            self.assertEqual(list(files.keys()), [self.name])
+            self.assertEqual(files[self.name].hash, info.hash)
+
+
+class TestHashFunc(unittest.TestCase):
+
+    def test_hashlib_new_only(self):
+        "Hashes only reachable through hashlib.new take data like the others"
+        name = 'sha512_256'
+        if name not in hashlib.algorithms_available or name in vars(hashlib):
+            self.skipTest(name + " is not a hashlib.new only hash here")
+        hashfunc = hexbase.get_hashfunc(name)
+        self.assertEqual(hashfunc().hexdigest(), hashlib.new(name).hexdigest())
+        self.assertEqual(hashfunc(b'abc').hexdigest(), hashlib.new(name, b'abc').hexdigest())
+        self.assertGreater(hexbase.hash_speed(hashfunc, size=1024), 0)
+
+    def test_unknown_hash(self):
+        with self.assertRaises(ValueError):
+            hexbase.get_hashfunc('not_a_hash')
+
+    def test_verbose_hash_option(self):
+        "pardatabase --hash with --verbose runs hash_speed on the chosen hash"
+        name = 'sha512_256'
+        if name not in hashlib.algorithms_available:
+            self.skipTest(name + " is not available here")
+        with tempfile.TemporaryDirectory() as target, tempfile.TemporaryDirectory() as bindir:
+            with open(os.path.join(target, 'small.txt'), 'w') as f:
+                f.write('hello\n')
+
+            # The file is under the minimum size for parity, so par2 only has to exist
+            par2 = os.path.join(bindir, 'par2')
+            with open(par2, 'w') as f:
+                f.write('#!/bin/sh\nexit 1\n')
+            os.chmod(par2, 0o755)
+            env = dict(os.environ, PATH=bindir + os.pathsep + os.environ.get('PATH', ''))
+
+            ret = subprocess.run([sys.executable, os.path.join(REPO, 'pardatabase.py'), target,
+                                  '--nice', '0', '--hash', name, '--verbose'], env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+        output = ret.stdout.decode(errors='replace')
+        self.assertEqual(ret.returncode, 0, output)
+        self.assertIn("Hashing speed:", output)
+
+
+if __name__ == "__main__":
+    unittest.main()